@@ -21,6 +21,9 @@ import hashlib
 import os
 import sqlite3
 from sqlalchemy import create_engine, text
+from calendario import dias_uteis, proxima_liquidacao
+import perfilador
+from cotacao import buscar_nota, calcular_risco, criar_registro_notas, extrair_dados_nfe, registrar_nota
 import streamlit as st 
 from io import StringIO
 import sqlite3
@@ -101,7 +104,18 @@ def authenticate_client(username, password):
     if row and row[0] == hash_password(password):
         return True
     return False
-    
+
+# Troca "," <-> "." num único passo (1,234.56 -> 1.234,56)
+TABELA_MOEDA_BR = str.maketrans(",.", ".,")
+
+def formatar_moeda_serie(valores):
+    """
+    Formata uma série de valores como moeda brasileira. Cada valor ainda passa
+    pelo format do Python; só a troca de separadores é feita na série inteira.
+    """
+    serie = pd.Series(valores, dtype="float64")
+    return "R$ " + serie.map("{:,.2f}".format).str.translate(TABELA_MOEDA_BR)
+
     # Conexão com o banco de dados (se ainda não estiver criado)
 conn = sqlite3.connect(DATA_PATH, check_same_thread=False)
 cursor = conn.cursor()
@@ -125,8 +139,34 @@ if 'email_contato' not in colunas:
     except sqlite3.OperationalError:
         pass
 
+# Adiciona 'chave_nfe' se não existir (uma proposta por nota)
+if 'chave_nfe' not in colunas:
+    try:
+        cursor.execute("ALTER TABLE proposals ADD COLUMN chave_nfe TEXT")
+    except sqlite3.OperationalError:
+        pass
+cursor.execute(
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_proposals_chave_nfe "
+    "ON proposals (chave_nfe) WHERE chave_nfe IS NOT NULL"
+)
+
+# Registro de NF-e já processadas, indexado pela chave de acesso (chNFe)
+criar_registro_notas(cursor)
+
 conn.commit()
 
+def gravar_cotacao(dados, taxa_ia, taxa_cliente=None):
+    """
+    Grava a última cotação da nota no registro numa conexão própria e de vida curta:
+    a conexão global é compartilhada entre as sessões, e um commit/rollback de outra
+    sessão não pode atingir esta gravação.
+    """
+    conn_registro = sqlite3.connect(DATA_PATH, timeout=10)
+    try:
+        registrar_nota(conn_registro, dados, taxa_ia, taxa_cliente)
+    finally:
+        conn_registro.close()
+
 # --- Fim da conexão SQLite ---
 
 
@@ -158,59 +198,95 @@ else:
     st.markdown('<div class="header">Antecipe agora. Sem compromisso.</div>', unsafe_allow_html=True)
     st.markdown('<div class="subheader">Envie uma nota fiscal eletrônica (.XML) e descubra agora quanto você pode antecipar.</div>', unsafe_allow_html=True)
 
-    # --- Upload de XML ---
-    xml_files = st.file_uploader("Escolha seus arquivos XML", type=["xml"], accept_multiple_files=True)
+    with perfilador.perfilar_rerun("página inicial", st.session_state.get("username")):
+        # --- Upload de XML ---
+        xml_files = st.file_uploader("Escolha seus arquivos XML", type=["xml"], accept_multiple_files=True)
 
-    valor_total = 0
-    if xml_files:
-        for xml_file in xml_files:
-            try:
-                tree = ET.parse(xml_file)
-                root = tree.getroot()
+        taxa_ia = 2.2  # taxa fixa da simulação pública
+        if xml_files:
+            # Os XMLs só são lidos quando o conjunto de arquivos muda; trocar página,
+            # ordenação ou sentido reaproveita a tabela guardada na sessão
+            ids_arquivos = tuple(xml_file.file_id for xml_file in xml_files)
+            if st.session_state.get("landing_ids") != ids_arquivos:
                 ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
-                valor_nota = float(root.find('.//nfe:vNF', ns).text.replace(',', '.'))
-                valor_receber = valor_nota * (1 - 2.2 / 100)
-                valor_total += valor_nota
-
-                st.markdown('<div class="resultado">', unsafe_allow_html=True)
-                st.markdown(f"**Arquivo:** {xml_file.name}", unsafe_allow_html=True)
-                st.markdown(f"**Valor da nota:** R$ {valor_nota:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."), unsafe_allow_html=True)
-                st.markdown(f"**Taxa sugerida:** 2,2%", unsafe_allow_html=True)
-                st.markdown(f"**Valor a receber:** R$ {valor_receber:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."), unsafe_allow_html=True)
-                st.markdown('</div>', unsafe_allow_html=True)
-            except Exception as e:
-                st.error(f"Erro ao processar {xml_file.name}: {e}")
-        taxa_ia = 2.23  # valor calculado ou fixo
-        valor_total = 9840.00  # exemplo
-        valor_total_receber = 9623.52  # exemplo
-
-        st.markdown(f"""
-        <div style='background-color:#E3F2FD; padding: 20px; border-radius: 10px; margin-top: 20px; text-align:center;'>
-            <p style='font-size:22px; font-weight:bold; margin-bottom:10px;'>📄 Valor total das notas:</p>
-            <p style='font-size:28px; color:#0D47A1; font-weight:bold;'>R$ {valor_total:,.2f}</p>
-            <p style='font-size:22px; font-weight:bold; margin-top:20px;'>📊 Taxa da IA aplicada:</p>
-            <p style='font-size:26px; color:#F57C00; font-weight:bold;'>{taxa_ia:.2f}%</p>
-            <p style='font-size:22px; font-weight:bold; margin-top:20px;'>💸 Valor total a receber:</p>
-            <p style='font-size:28px; color:#2E7D32; font-weight:bold;'>R$ {valor_total_receber:,.2f}</p>
-        </div>
-        """.replace(",", "X").replace(".", ",").replace("X", "."), unsafe_allow_html=True)
+                linhas, falhas = [], []
+                with perfilador.secao("upload de XMLs"):
+                    for xml_file in xml_files:
+                        try:
+                            root = ET.parse(xml_file).getroot()
+                            linhas.append((xml_file.name, float(root.find('.//nfe:vNF', ns).text.replace(',', '.'))))
+                        except Exception as e:
+                            falhas.append(f"{xml_file.name}: {e}")
+
+                # Uma única tabela para todas as notas (em vez de vários blocos HTML por arquivo)
+                df_base = pd.DataFrame(linhas, columns=["Arquivo", "Valor da nota"])
+                df_base["Valor a receber"] = df_base["Valor da nota"] * (1 - taxa_ia / 100)
+                st.session_state.landing_ids = ids_arquivos
+                st.session_state.landing_notas = (df_base, falhas)
+            df_notas, falhas = st.session_state.landing_notas
+
+            if falhas:
+                st.error("Erro ao processar:\n\n" + "\n\n".join(falhas))
+
+            if not df_notas.empty:
+                col_ordem, col_sentido = st.columns([2, 1])
+                with col_ordem:
+                    ordenar_por = st.selectbox("Ordenar por", list(df_notas.columns), index=1)
+                with col_sentido:
+                    decrescente = st.checkbox("Decrescente", value=True)
+                df_notas = df_notas.sort_values(ordenar_por, ascending=not decrescente, ignore_index=True)
+
+                # Paginação: cada rerun envia só uma página ao navegador
+                itens_por_pagina = 25
+                total_paginas = max(1, math.ceil(len(df_notas) / itens_por_pagina))
+                pagina = st.number_input("Página", min_value=1, max_value=total_paginas, value=1, step=1)
+                inicio = (pagina - 1) * itens_por_pagina
+                df_pagina = df_notas.iloc[inicio:inicio + itens_por_pagina]
+
+                valor_total = df_notas["Valor da nota"].sum()
+                valor_total_receber = df_notas["Valor a receber"].sum()
+                total = pd.DataFrame(
+                    [[f"Total ({len(df_notas)} notas)", valor_total, valor_total_receber]],
+                    columns=df_notas.columns
+                )
+
+                # Os valores viram texto (R$ 1.234,56) para exibição: st.table não ordena
+                # pelo cabeçalho, então a ordem é sempre a do "Ordenar por", feita nos números,
+                # e o total fica numa tabela à parte, fora da ordenação
+                for tabela in (df_pagina.copy(), total):
+                    tabela.insert(2, "Taxa sugerida", f"{taxa_ia:.1f}%".replace(".", ","))
+                    tabela["Valor da nota"] = formatar_moeda_serie(tabela["Valor da nota"])
+                    tabela["Valor a receber"] = formatar_moeda_serie(tabela["Valor a receber"])
+                    st.table(tabela, hide_index=True)
+                st.caption(f"Página {pagina} de {total_paginas}")
+
+                st.markdown(f"""
+                <div style='background-color:#E3F2FD; padding: 20px; border-radius: 10px; margin-top: 20px; text-align:center;'>
+                    <p style='font-size:22px; font-weight:bold; margin-bottom:10px;'>📄 Valor total das notas:</p>
+                    <p style='font-size:28px; color:#0D47A1; font-weight:bold;'>R$ {valor_total:,.2f}</p>
+                    <p style='font-size:22px; font-weight:bold; margin-top:20px;'>📊 Taxa da IA aplicada:</p>
+                    <p style='font-size:26px; color:#F57C00; font-weight:bold;'>{taxa_ia:.2f}%</p>
+                    <p style='font-size:22px; font-weight:bold; margin-top:20px;'>💸 Valor total a receber:</p>
+                    <p style='font-size:28px; color:#2E7D32; font-weight:bold;'>R$ {valor_total_receber:,.2f}</p>
+                </div>
+                """.translate(TABELA_MOEDA_BR), unsafe_allow_html=True)
 
 
-    else:
-        st.info('Faça upload de um ou mais XMLs para começar a simulação.')
+        else:
+            st.info('Faça upload de um ou mais XMLs para começar a simulação.')
 
 
-    # --- Botões de Navegação ---
-    col1, col2 = st.columns(2)
-    with col1:
-        if st.button("Assinar e continuar"):
-            st.session_state.navigate = "register"
-    with col2:
-        if st.button("Já é cliente? Faça login."):
-            st.session_state.navigate = "login"
+        # --- Botões de Navegação ---
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Assinar e continuar"):
+                st.session_state.navigate = "register"
+        with col2:
+            if st.button("Já é cliente? Faça login."):
+                st.session_state.navigate = "login"
 
-    # Interrompe antes do fluxo de login/cadastro
-    st.stop()
+        # Interrompe antes do fluxo de login/cadastro
+        st.stop()
 
 st.markdown(
     """
@@ -373,6 +449,7 @@ def clean_text(text):
     """
     return unicodedata.normalize('NFKD', text).encode('latin1', 'ignore').decode('latin1')
 
+@perfilador.medir("gerar_pdf")
 def gerar_pdf(data_dict,
                grafico_risco_bytes,
                grafico_fatores_bytes,
@@ -482,6 +559,7 @@ def gerar_pdf(data_dict,
     return BytesIO(pdf.output(dest='S').encode('latin1'))
 
 # Interface de Análise de Risco (sem Serasa)
+@perfilador.medir("exibir_interface_analise_risco")
 def exibir_interface_analise_risco():
     st.header("Análise de Risco e Precificação")
     client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
@@ -506,8 +584,8 @@ def exibir_interface_analise_risco():
         if not enviar:
             return
 
-        # 1) Cálculo do prazo
-        prazo = (data_vencimento - data_operacao).days
+        # 1) Cálculo do prazo em dias úteis até a liquidação (vencimento em feriado rola para o próximo dia útil)
+        prazo = int(dias_uteis(data_operacao, proxima_liquidacao(data_vencimento)))
 
         # 2) Componentes de risco (mesma lógica da aba de cotação)
         risco_score = 0 if score_serasa >= 800 else 0.5 if score_serasa >= 600 else 1
@@ -535,7 +613,7 @@ def exibir_interface_analise_risco():
 
         # 7) Exibição dos resultados
         st.markdown("## Resultado da Simulação")
-        st.write(f"Prazo: {prazo} dias")
+        st.write(f"Prazo: {prazo} dias úteis")
         st.markdown(
             f"<p style='font-size:24px; font-weight:bold; margin:10px 0;'>"
             f"🔥 Taxa sugerida pela IA: {taxa_ia}%</p>",
@@ -546,17 +624,180 @@ def exibir_interface_analise_risco():
 
 
 
+# Bloco de cotação de uma nota: roda como fragmento, então mexer nos campos de uma
+# nota reexecuta só este bloco, sem refazer o restante da página nem as outras notas.
+@st.fragment
+@perfilador.perfilar("fragmento de nota", lambda: st.session_state.get("username"))
+@perfilador.medir("exibir_cotacao_nota")
+def exibir_cotacao_nota(nome_arquivo, dados, registro, nome_cliente, user_tel, user_email, permissoes):
+    valor_nota   = dados["valor_nota"]
+    cnpj_dest    = dados["cnpj"]
+    data_emissao = dados["data_emissao"]
+    parcelas     = dados["parcelas"]
+    notas_sessao = st.session_state.setdefault("notas_sessao", set())
+
+    st.markdown("### Dados de Crédito (manual)")
+
+    # Cria uma chave única segura baseada no nome do arquivo XML
+    chave_unica = nome_arquivo.replace(".", "_").replace("-", "_").replace(" ", "_")
+
+    score_xml     = st.number_input(
+      "Score de Crédito (0 a 1000)", 0, 1000, 750, key=f"score_{chave_unica}"
+    )
+    idade_empresa = st.number_input(
+        "Idade da empresa (anos)", 0, 100, 5, key=f"idade_{chave_unica}"
+    )
+    protestos     = st.selectbox(
+        "Protestos ou dívidas públicas?", ["Não", "Sim"], key=f"protestos_{chave_unica}"
+    )
+    faturamento   = st.number_input(
+        "Último faturamento (R$)", min_value=0.0, format="%.2f", key=f"faturamento_{chave_unica}"
+    )
+
+    # Risco total e taxa sugerida pela IA
+    risco_total, taxa_ia = calcular_risco(score_xml, idade_empresa, protestos == "Sim", faturamento)
+
+    # Nota já registrada: parte da taxa escolhida pelo cliente ou, se não houver
+    # (notas gravadas pelo serviço de parceiros), da última taxa da IA registrada
+    taxa_registrada = None
+    if registro:
+        taxa_registrada = next((t for t in (registro["taxa_cliente"], registro["taxa_ia"]) if t is not None), None)
+    taxa_cliente = st.number_input(
+        "Defina a taxa de antecipação (%)",
+        min_value=0.0,
+        max_value=10.0,
+        step=0.1,
+        value=taxa_registrada if taxa_registrada is not None else taxa_ia,
+        format="%.2f",
+        key=f"taxa_{chave_unica}"
+    )
+
+    # Última cotação no registro: grava a nota nova na primeira exibição e, depois,
+    # sempre que o usuário mudar os dados; a primeira exibição de uma nota já
+    # registrada (campos ainda nos valores padrão) não sobrescreve a cotação salva.
+    if dados["chave_nfe"]:
+        cotacoes_sessao = st.session_state.setdefault("cotacoes_sessao", {})
+        cotacao_atual = (taxa_ia, taxa_cliente)
+        if dados["chave_nfe"] not in cotacoes_sessao and registro:
+            cotacoes_sessao[dados["chave_nfe"]] = cotacao_atual
+        elif cotacoes_sessao.get(dados["chave_nfe"]) != cotacao_atual:
+            gravar_cotacao(dados, taxa_ia, taxa_cliente)
+            cotacoes_sessao[dados["chave_nfe"]] = cotacao_atual
+            if not registro:
+                notas_sessao.add(dados["chave_nfe"])
+
+
+
+    valor_receber = valor_nota * (1 - taxa_cliente/100)
+    st.metric("Você receberá", f"{formatar_moeda(valor_receber)}")
+    st.write("Este cálculo não leva em consideração dados de concentração de carteira e eventuais riscos que não apareçam no Serasa")
+
+    receber_propostas = st.checkbox(
+        "Desejo receber propostas e que entrem em contato comigo", key=f"contato_{chave_unica}"
+    )
+    if receber_propostas:
+        telefone_contato = st.text_input("Telefone para contato", value=user_tel, key=f"telefone_contato_{chave_unica}")
+        email_contato = st.text_input("E-mail para contato", value=user_email, key=f"email_contato_{chave_unica}")
+    else:
+        telefone_contato = ""
+        email_contato = ""
+
+    # ✅ Aqui está o botão, agora posicionado corretamente
+    if "propostas" in permissoes:
+        if st.button("Solicitar proposta", key=f"xml_solicitar_{chave_unica}"):
+            # Conexão própria e de vida curta: a conexão global é compartilhada entre as
+            # sessões, e um commit/rollback de outra sessão não pode atingir esta proposta.
+            conn_proposta = sqlite3.connect(DATA_PATH, timeout=10)
+            try:
+                # A proposta é inserida primeiro, numa transação aberta: o índice único em
+                # chave_nfe barra a segunda solicitação da mesma nota antes do WhatsApp, e
+                # a inserção só é confirmada depois que a mensagem sai.
+                contato = "SIM" if receber_propostas else "NÃO"
+                conn_proposta.execute("BEGIN IMMEDIATE")
+                conn_proposta.execute(
+                    """
+                    INSERT INTO proposals
+                      (nome_cliente, cnpj, valor_nota, taxa_ia, taxa_cliente,
+                       deseja_contato, telefone_contato, email_contato, created_at, chave_nfe)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        nome_cliente,
+                        cnpj_dest,
+                        valor_nota,
+                        taxa_ia,
+                        taxa_cliente,
+                        contato,
+                        telefone_contato,
+                        email_contato,
+                        datetime.now().isoformat(),
+                        dados["chave_nfe"]
+                    )
+                )
+
+                msg_body = (
+                    f"📩 *Nova solicitação de proposta*\n"
+                    f"• Cliente: {nome_cliente}\n"
+                    f"• CNPJ: {cnpj_dest}\n"
+                    f"• Valor da NF-e: {formatar_moeda(valor_nota)}\n"
+                    f"• Emissão: {data_emissao or '—'}\n"
+                    f"• Taxa IA sugerida: {taxa_ia}%\n"
+                    f"• Taxa escolhida: {taxa_cliente}%\n"
+                )
+
+                if parcelas:
+                    msg_body += "• Parcelas:\n"
+                    for p in parcelas:
+                        num = f"{p['nDup']}. " if p['nDup'] else ""
+                        msg_body += f"   – {num}{p['dVenc']} → {p['vDup']}\n"
+
+                msg_body += f"• Deseja contato: {contato}\n"
+                if receber_propostas:
+                    msg_body += f"• Telefone para contato: {telefone_contato}\n"
+                    msg_body += f"• E-mail para contato: {email_contato}\n"
+
+                client = Client(
+                    st.secrets["TWILIO_ACCOUNT_SID"],
+                    st.secrets["TWILIO_AUTH_TOKEN"]
+                )
+                client.messages.create(
+                    body=msg_body,
+                    from_="whatsapp:+14155238886",
+                    to=f"whatsapp:{st.secrets['ADMIN_WHATSAPP_TO']}"
+                )
+                conn_proposta.commit()
+                if dados["chave_nfe"]:
+                    registrar_nota(conn_proposta, dados, taxa_ia, taxa_cliente)
+                st.success("✅ Proposta enviada!")
+            except sqlite3.IntegrityError:
+                conn_proposta.rollback()
+                st.warning("⚠️ Já existe uma proposta registrada para esta nota.")
+            except Exception as e:
+                # Falha no envio desfaz a proposta ainda não confirmada
+                conn_proposta.rollback()
+                st.error(f"Erro ao processar a proposta: {e}")
+            finally:
+                conn_proposta.close()
+    else:
+        st.warning("⚠️ Seu plano atual não permite solicitar propostas.")
+
+
 # Interface de Cotação de Crédito via XML (sem Serasa)
+@perfilador.medir("exibir_interface_cliente_cotacao")
 def exibir_interface_cliente_cotacao(permissoes):
     st.header("Cotação de Antecipação de Crédito")
-    user_tel, user_email = "", ""
-    try:
-        cursor.execute("SELECT celular, email FROM clients WHERE username = ?", (st.session_state.username,))
-        row = cursor.fetchone()
-        if row:
-            user_tel, user_email = row
-    except Exception:
-        pass
+    # Contato do usuário logado: consultado uma vez por sessão
+    if "contato_usuario" not in st.session_state:
+        user_tel, user_email = "", ""
+        try:
+            cursor.execute("SELECT celular, email FROM clients WHERE username = ?", (st.session_state.username,))
+            row = cursor.fetchone()
+            if row:
+                user_tel, user_email = row
+        except Exception:
+            pass
+        st.session_state.contato_usuario = (user_tel, user_email)
+    user_tel, user_email = st.session_state.contato_usuario
 
     st.write("Faça o upload do **XML da Nota Fiscal Eletrônica (NF-e)** para gerar sua cotação:")
     nome_cliente = st.text_input("Nome do cliente", key="xml_nome_cliente")
@@ -565,158 +806,49 @@ def exibir_interface_cliente_cotacao(permissoes):
     if xml_files:
         for xml_file in xml_files:
             try:
-                tree = ET.parse(xml_file)
-                root = tree.getroot()
-                ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
+                root = ET.parse(xml_file).getroot()
+                dados = extrair_dados_nfe(root)
 
-                valor_nota = float(root.find('.//nfe:vNF', ns).text.replace(",", "."))
-                cnpj_dest  = root.find('.//nfe:CNPJ', ns).text
-                data_emissao_tag = root.find('.//nfe:dhEmi', ns)
-                data_emissao = None
+                # Nota já vista: do registro vem só a última cotação; os campos são os do XML
+                registro = buscar_nota(conn, dados["chave_nfe"]) if dados["chave_nfe"] else None
 
-                if data_emissao_tag is not None:
-                    raw = data_emissao_tag.text[:10]
-                    date_obj = datetime.strptime(raw, "%Y-%m-%d")
-                    data_emissao = date_obj.strftime("%d/%m/%Y")
+                valor_nota   = dados["valor_nota"]
+                cnpj_dest    = dados["cnpj"]
+                data_emissao = dados["data_emissao"]
+                parcelas     = dados["parcelas"]
 
                 st.markdown("----")
                 st.subheader(f"🧾 Nota: {xml_file.name}")
+                notas_sessao = st.session_state.setdefault("notas_sessao", set())
+                if registro and dados["chave_nfe"] not in notas_sessao:
+                    st.info("Esta nota já foi cotada anteriormente; exibindo a última cotação registrada.")
                 st.write(f"Valor: {formatar_moeda(valor_nota)}")
                 st.write(f"CNPJ: {cnpj_dest}")
                 if data_emissao:
                     st.write(f"Data de emissão: {data_emissao}")
 
-            except Exception as e:
-                st.error(f"Erro ao processar {xml_file.name}: {e}")
-
                 if parcelas:
+                    # Prazos de todas as parcelas calculados numa única chamada ao calendário
+                    prazos = None
+                    if all(p['dVenc'] for p in parcelas):
+                        liquidacoes = proxima_liquidacao([p['dVenc'] for p in parcelas])
+                        prazos = dias_uteis(datetime.today().date(), liquidacoes)
                     st.markdown("**Parcelas e vencimentos:**")
-                    for p in parcelas:
+                    for i, p in enumerate(parcelas):
                         num = f"Parcela {p['nDup']}: " if p['nDup'] else ""
-                        st.write(f"- {num}{p['dVenc']} → {p['vDup']}")
-                        
-            st.markdown("### Dados de Crédito (manual)")
-
-# Cria uma chave única segura baseada no nome do arquivo XML
-            chave_unica = xml_file.name.replace(".", "_").replace("-", "_").replace(" ", "_")
-
-            score_xml     = st.number_input(
-              "Score de Crédito (0 a 1000)", 0, 1000, 750, key=f"score_{chave_unica}"
-            )
-            idade_empresa = st.number_input(
-                "Idade da empresa (anos)", 0, 100, 5, key=f"idade_{chave_unica}"
-            )
-            protestos     = st.selectbox(
-                "Protestos ou dívidas públicas?", ["Não", "Sim"], key=f"protestos_{chave_unica}"
-            )
-            faturamento   = st.number_input(
-                "Último faturamento (R$)", min_value=0.0, format="%.2f", key=f"faturamento_{chave_unica}"
-            )
-
-# Cálculo do risco total
-            risco_score = round(1 / (1 + math.exp(-(600 - score_xml) / 50)), 3)
-            risco_idade = round(1 / (1 + math.exp(-(5 - idade_empresa) / 1)), 3)
-            risco_protesto = 1 if protestos == "Sim" else 0
-            risco_fat = round(1 / (1 + math.exp(-(500_000 - faturamento) / 100_000)), 3)
-            risco_total = round(
-                (risco_score    * 0.40
-                + risco_idade   * 0.20
-                + risco_protesto* 0.25
-                + risco_fat     * 0.15)
-                * 100,
-                2
-            )
+                        prazo_txt = f" ({prazos[i]} dias úteis)" if prazos is not None else ""
+                        st.write(f"- {num}{p['dVenc']} → {p['vDup']}{prazo_txt}")
+                    valores = np.array([float(p['vDup'] or 0) for p in parcelas])
+                    if prazos is not None and valores.sum() > 0:
+                        prazo_medio = float(np.average(np.maximum(prazos, 0), weights=valores))
+                        st.write(f"Prazo médio ponderado: {prazo_medio:.0f} dias úteis")
 
-# Taxa sugerida pela IA
-            taxa_ia = round(risco_total * 0.1, 2)
-
-            taxa_cliente = st.number_input(
-                "Defina a taxa de antecipação (%)",
-                min_value=0.0,
-                max_value=10.0,
-                step=0.1,
-                value=taxa_ia,
-                format="%.2f",
-                key=f"taxa_{chave_unica}"
-            )    
-
-
-
-            valor_receber = valor_nota * (1 - taxa_cliente/100)
-            st.metric("Você receberá", f"{formatar_moeda(valor_receber)}")
-            st.write("Este cálculo não leva em consideração dados de concentração de carteira e eventuais riscos que não apareçam no Serasa")
+            except Exception as e:
+                st.error(f"Erro ao processar {xml_file.name}: {e}")
+                continue
 
-            receber_propostas = st.checkbox("Desejo receber propostas e que entrem em contato comigo")
-            if receber_propostas:
-                telefone_contato = st.text_input("Telefone para contato", value=user_tel, key="telefone_contato")
-                email_contato = st.text_input("E-mail para contato", value=user_email, key="email_contato")
-            else:
-                telefone_contato = ""
-                email_contato = ""
-
-            # ✅ Aqui está o botão, agora posicionado corretamente
-            if "propostas" in permissoes:
-                if st.button("Solicitar proposta", key="xml_solicitar"):
-                    try:
-                        msg_body = (
-                            f"📩 *Nova solicitação de proposta*\n"
-                            f"• Cliente: {nome_cliente}\n"
-                            f"• CNPJ: {cnpj_dest}\n"
-                            f"• Valor da NF-e: {formatar_moeda(valor_nota)}\n"
-                            f"• Emissão: {data_emissao or '—'}\n"
-                            f"• Taxa IA sugerida: {taxa_ia}%\n"
-                            f"• Taxa escolhida: {taxa_cliente}%\n"
-                        )
-
-                        if parcelas:
-                            msg_body += "• Parcelas:\n"
-                            for p in parcelas:
-                                num = f"{p['nDup']}. " if p['nDup'] else ""
-                                msg_body += f"   – {num}{p['dVenc']} → {p['vDup']}\n"
-
-                        contato = "SIM" if receber_propostas else "NÃO"
-                        msg_body += f"• Deseja contato: {contato}\n"
-                        if receber_propostas:
-                            msg_body += f"• Telefone para contato: {telefone_contato}\n"
-                            msg_body += f"• E-mail para contato: {email_contato}\n"
-
-                        client = Client(
-                            st.secrets["TWILIO_ACCOUNT_SID"],
-                            st.secrets["TWILIO_AUTH_TOKEN"]
-                        )
-                        client.messages.create(
-                            body=msg_body,
-                            from_="whatsapp:+14155238886",
-                            to=f"whatsapp:{st.secrets['ADMIN_WHATSAPP_TO']}"
-                        )
-                        st.success("✅ Proposta enviada!")
-
-                        cursor.execute(
-                            """
-                            INSERT INTO proposals
-                              (nome_cliente, cnpj, valor_nota, taxa_ia, taxa_cliente,
-                               deseja_contato, telefone_contato, email_contato, created_at)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                            """,
-                            (
-                                nome_cliente,
-                                cnpj_dest,
-                                valor_nota,
-                                taxa_ia,
-                                taxa_cliente,
-                                contato,
-                                telefone_contato,
-                                email_contato,
-                                datetime.now().isoformat()
-                            )
-                        )
-                        conn.commit()
-                    except Exception as e:
-                        st.error(f"Erro ao processar a proposta: {e}")
-            else:
-                st.warning("⚠️ Seu plano atual não permite solicitar propostas.")
+            exibir_cotacao_nota(xml_file.name, dados, registro, nome_cliente, user_tel, user_email, permissoes)
 
-                
 
 # --- Roteamento pós-login ---
 if st.session_state.role == 'admin':
@@ -750,30 +882,90 @@ if st.session_state.role == 'admin':
         st.error(f"Erro ao buscar propostas: {e}")
     else:
         st.info("Ainda não há propostas.")
+
+    st.header("⏱️ Perfilamento de Desempenho")
+    alvo_perfil = st.text_input(
+        "Capturar só este usuário ou página (opcional)",
+        value=perfilador.alvo() or "",
+        help="Nome de usuário do cliente ou um dos rótulos: página inicial, painel do cliente, fragmento de nota. "
+             "Em branco, captura o próximo rerun de qualquer sessão, inclusive visitantes anônimos."
+    ).strip()
+    armado = st.toggle(
+        "Perfilar o próximo rerun de cliente",
+        value=perfilador.esta_armado(),
+        help="Mede tempo por função e pico de memória do próximo rerun (página inicial, painel do cliente ou bloco de uma nota) e desarma em seguida."
+    )
+    if armado and (not perfilador.esta_armado() or (perfilador.alvo() or "") != alvo_perfil):
+        perfilador.armar(alvo_perfil)
+    elif not armado and perfilador.esta_armado():
+        perfilador.desarmar()
+
+    if perfilador.perfis:
+        opcoes = list(range(len(perfilador.perfis)))
+        escolhido = st.selectbox(
+            f"Perfis capturados (últimos {perfilador.MAX_PERFIS})",
+            opcoes,
+            format_func=lambda i: (
+                f"{perfilador.perfis[i]['quando']:%d/%m/%Y %H:%M:%S} – {perfilador.perfis[i]['rotulo']} "
+                f"[{perfilador.perfis[i]['usuario'] or 'anônimo'}] "
+                f"({perfilador.perfis[i]['duracao']:.2f} s)"
+            )
+        )
+        perfil = perfilador.perfis[escolhido]
+        col1, col2 = st.columns(2)
+        col1.metric("Duração do rerun", f"{perfil['duracao']:.3f} s")
+        col2.metric("Pico de memória", f"{perfil['pico_memoria'] / 1024 / 1024:.2f} MB")
+        st.caption(
+            "O pico de memória vem do tracemalloc, que mede o processo inteiro: inclui as alocações "
+            "de outras sessões feitas durante a captura."
+        )
+
+        if perfil["secoes"]:
+            st.subheader("Seções")
+            df_secoes = pd.DataFrame(perfil["secoes"])
+            df_secoes["pico_memoria"] = df_secoes["pico_memoria"] / 1024 / 1024
+            st.dataframe(
+                df_secoes.rename(columns={"secao": "Seção", "tempo": "Tempo (s)", "pico_memoria": "Pico de memória (MB)"}),
+                hide_index=True
+            )
+
+        st.subheader("Funções (tempo cumulativo)")
+        st.dataframe(
+            pd.DataFrame(perfil["funcoes"]).rename(columns={
+                "funcao": "Função",
+                "chamadas": "Chamadas",
+                "tempo_proprio": "Tempo próprio (s)",
+                "tempo_cumulativo": "Tempo cumulativo (s)",
+            }),
+            hide_index=True
+        )
+    else:
+        st.info("Nenhum perfil capturado ainda.")
 elif st.session_state.role == 'cliente':
-    st.header("👤 Dashboard do Cliente")
+    with perfilador.perfilar_rerun("painel do cliente", st.session_state.get("username")):
+        st.header("👤 Dashboard do Cliente")
     
-    plano_atual = st.session_state.get("plano", "").split("–")[0].strip()
-    permissoes = PERMISSOES_POR_PLANO.get(plano_atual, [])
-
-    st.write("Plano ativo:", plano_atual)
-
-    abas = []
-    if "cotacao" in permissoes:
-        abas.append("💰 Cotação de Antecipação")
-    if "analise_risco" in permissoes:
-        abas.append("⚙️ Análise de Risco")
-
-    if abas:
-        tabs = st.tabs(abas)
-        if "💰 Cotação de Antecipação" in abas:
-            with tabs[abas.index("💰 Cotação de Antecipação")]:
-                exibir_interface_cliente_cotacao(permissoes)
-        if "⚙️ Análise de Risco" in abas:
-            with tabs[abas.index("⚙️ Análise de Risco")]:
-                exibir_interface_analise_risco()
-    else:
-        st.warning("Seu plano atual não dá acesso a funcionalidades. Atualize para aproveitar a plataforma.")
+        plano_atual = st.session_state.get("plano", "").split("–")[0].strip()
+        permissoes = PERMISSOES_POR_PLANO.get(plano_atual, [])
+
+        st.write("Plano ativo:", plano_atual)
+
+        abas = []
+        if "cotacao" in permissoes:
+            abas.append("💰 Cotação de Antecipação")
+        if "analise_risco" in permissoes:
+            abas.append("⚙️ Análise de Risco")
+
+        if abas:
+            tabs = st.tabs(abas)
+            if "💰 Cotação de Antecipação" in abas:
+                with tabs[abas.index("💰 Cotação de Antecipação")]:
+                    exibir_interface_cliente_cotacao(permissoes)
+            if "⚙️ Análise de Risco" in abas:
+                with tabs[abas.index("⚙️ Análise de Risco")]:
+                    exibir_interface_analise_risco()
+        else:
+            st.warning("Seu plano atual não dá acesso a funcionalidades. Atualize para aproveitar a plataforma.")
 
 
 # Configuração de localização para formatação brasileira
@@ -0,0 +1,92 @@
+import numpy as np
+
+# Calendário de dias úteis bancários (feriados nacionais + Carnaval e Corpus Christi)
+ANO_INICIAL = 2000
+ANO_FINAL = 2080
+
+FERIADOS_FIXOS = [
+    (1, 1),    # Confraternização Universal
+    (4, 21),   # Tiradentes
+    (5, 1),    # Dia do Trabalho
+    (9, 7),    # Independência
+    (10, 12),  # Nossa Senhora Aparecida
+    (11, 2),   # Finados
+    (11, 15),  # Proclamação da República
+    (12, 25),  # Natal
+]
+
+# Dias relativos à Páscoa
+FERIADOS_MOVEIS = [
+    -48,  # Carnaval (segunda)
+    -47,  # Carnaval (terça)
+    -2,   # Sexta-feira Santa
+    60,   # Corpus Christi
+]
+
+
+def _montar_datas(anos, meses, dias):
+    meses_desde_1970 = (np.asarray(anos) - 1970) * 12 + (np.asarray(meses) - 1)
+    return meses_desde_1970.astype("datetime64[M]").astype("datetime64[D]") + (np.asarray(dias) - 1)
+
+
+def calcular_pascoa(anos):
+    """
+    Domingo de Páscoa para um array de anos (algoritmo de Meeus/Jones/Butcher).
+    """
+    anos = np.asarray(anos, dtype=np.int64)
+    a = anos % 19
+    b, c = anos // 100, anos % 100
+    d, e = b // 4, b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    mes = (h + l - 7 * m + 114) // 31
+    dia = (h + l - 7 * m + 114) % 31 + 1
+    return _montar_datas(anos, mes, dia)
+
+
+def gerar_feriados(ano_inicial=ANO_INICIAL, ano_final=ANO_FINAL):
+    """
+    Array ordenado de feriados bancários entre os dois anos (inclusive).
+    """
+    anos = np.arange(ano_inicial, ano_final + 1)
+    fixos = [_montar_datas(anos, mes, dia) for mes, dia in FERIADOS_FIXOS]
+    # Dia da Consciência Negra é feriado nacional desde 2024 (Lei 14.759/2023)
+    fixos.append(_montar_datas(anos[anos >= 2024], 11, 20))
+    pascoa = calcular_pascoa(anos)
+    moveis = [pascoa + np.timedelta64(delta, "D") for delta in FERIADOS_MOVEIS]
+    return np.unique(np.concatenate(fixos + moveis))
+
+
+FERIADOS = gerar_feriados()
+CALENDARIO = np.busdaycalendar(weekmask="1111100", holidays=FERIADOS)
+
+
+def _datas(datas):
+    return np.asarray(datas, dtype="datetime64[D]")
+
+
+def dias_uteis(inicio, fim):
+    """
+    Quantidade de dias úteis entre as datas (início incluso, fim excluído).
+    Aceita datas isoladas ou arrays inteiros; negativo quando fim < início.
+    """
+    return np.busday_count(_datas(inicio), _datas(fim), busdaycal=CALENDARIO)
+
+
+def eh_dia_util(datas):
+    """
+    Indica, data a data, se é dia útil bancário.
+    """
+    return np.is_busday(_datas(datas), busdaycal=CALENDARIO)
+
+
+def proxima_liquidacao(datas, dias=0):
+    """
+    Data de liquidação: a própria data (ou o próximo dia útil, se não for útil)
+    avançada em `dias` dias úteis.
+    """
+    return np.busday_offset(_datas(datas), dias, roll="forward", busdaycal=CALENDARIO)
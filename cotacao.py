@@ -0,0 +1,153 @@
+import json
+from datetime import datetime
+
+import numpy as np
+
+# Lógica de cotação compartilhada entre a aba de cotação (app.py) e o serviço HTTP
+# (servico_cotacao.py): extração da NF-e, risco/taxa e registro de notas.
+
+NS_NFE = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
+
+
+def extrair_dados_nfe(root):
+    """
+    Extrai da NF-e a chave de acesso (44 dígitos) e os campos usados na cotação.
+    """
+    chave_tag = root.find('.//nfe:chNFe', NS_NFE)
+    if chave_tag is not None:
+        chave = chave_tag.text.strip()
+    else:
+        inf_nfe = root.find('.//nfe:infNFe', NS_NFE)
+        chave = (inf_nfe.get('Id', '') if inf_nfe is not None else '').replace('NFe', '')
+    if not (len(chave) == 44 and chave.isdigit()):
+        chave = None
+
+    data_emissao = None
+    data_emissao_tag = root.find('.//nfe:dhEmi', NS_NFE)
+    if data_emissao_tag is not None:
+        data_emissao = datetime.strptime(data_emissao_tag.text[:10], "%Y-%m-%d").strftime("%d/%m/%Y")
+
+    parcelas = [
+        {
+            "nDup": dup.findtext('nfe:nDup', '', NS_NFE),
+            "dVenc": dup.findtext('nfe:dVenc', '', NS_NFE),
+            "vDup": dup.findtext('nfe:vDup', '', NS_NFE),
+        }
+        for dup in root.findall('.//nfe:dup', NS_NFE)
+    ]
+
+    return {
+        "chave_nfe": chave,
+        "valor_nota": float(root.find('.//nfe:vNF', NS_NFE).text.replace(",", ".")),
+        "cnpj": root.find('.//nfe:CNPJ', NS_NFE).text,
+        "data_emissao": data_emissao,
+        "parcelas": parcelas,
+    }
+
+
+def calcular_risco_lote(score, idade_empresa, protestos, faturamento):
+    """
+    Risco total (%) e taxa sugerida pela IA (%) para arrays inteiros de notas.
+    """
+    score = np.asarray(score, dtype=np.float64)
+    idade_empresa = np.asarray(idade_empresa, dtype=np.float64)
+    faturamento = np.asarray(faturamento, dtype=np.float64)
+    # Faturamentos muito altos estouram o exp e levam o risco a zero, que é o limite correto
+    with np.errstate(over="ignore"):
+        risco_score = np.round(1 / (1 + np.exp(-(600 - score) / 50)), 3)
+        risco_idade = np.round(1 / (1 + np.exp(-(5 - idade_empresa) / 1)), 3)
+        risco_fat = np.round(1 / (1 + np.exp(-(500_000 - faturamento) / 100_000)), 3)
+    risco_protesto = np.asarray(protestos, dtype=np.float64)
+    risco_total = np.round(
+        (risco_score    * 0.40
+        + risco_idade   * 0.20
+        + risco_protesto* 0.25
+        + risco_fat     * 0.15)
+        * 100,
+        2
+    )
+    taxa_ia = np.round(risco_total * 0.1, 2)
+    return risco_total, taxa_ia
+
+
+def calcular_risco(score, idade_empresa, protestos, faturamento):
+    """
+    Versão para uma única nota de `calcular_risco_lote`.
+    """
+    risco_total, taxa_ia = calcular_risco_lote([score], [idade_empresa], [protestos], [faturamento])
+    return float(risco_total[0]), float(taxa_ia[0])
+
+
+def criar_registro_notas(cursor):
+    """
+    Cria, se ainda não existir, a tabela de notas indexada pela chave de acesso.
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS notas (
+        chave_nfe TEXT PRIMARY KEY,
+        cnpj TEXT,
+        valor_nota REAL,
+        data_emissao TEXT,
+        parcelas TEXT,
+        taxa_ia REAL,
+        taxa_cliente REAL,
+        created_at TEXT,
+        updated_at TEXT
+    )
+    """)
+
+
+def buscar_nota(conn, chave_nfe):
+    """
+    Consulta o registro de notas pela chave de acesso. Retorna None se a nota é nova.
+    """
+    row = conn.execute(
+        "SELECT cnpj, valor_nota, data_emissao, parcelas, taxa_ia, taxa_cliente FROM notas WHERE chave_nfe = ?",
+        (chave_nfe,)
+    ).fetchone()
+    if not row:
+        return None
+    cnpj, valor_nota, data_emissao, parcelas, taxa_ia, taxa_cliente = row
+    return {
+        "chave_nfe": chave_nfe,
+        "cnpj": cnpj,
+        "valor_nota": valor_nota,
+        "data_emissao": data_emissao,
+        "parcelas": json.loads(parcelas or "[]"),
+        "taxa_ia": taxa_ia,
+        "taxa_cliente": taxa_cliente,
+    }
+
+
+def registrar_notas(conn, cotacoes):
+    """
+    Grava (ou atualiza) várias notas no registro numa única transação.
+    `cotacoes` é uma lista de tuplas (dados, taxa_ia, taxa_cliente).
+    """
+    agora = datetime.now().isoformat()
+    conn.executemany(
+        """
+        INSERT INTO notas
+          (chave_nfe, cnpj, valor_nota, data_emissao, parcelas, taxa_ia, taxa_cliente, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(chave_nfe) DO UPDATE SET
+          taxa_ia = excluded.taxa_ia,
+          taxa_cliente = COALESCE(excluded.taxa_cliente, notas.taxa_cliente),
+          updated_at = excluded.updated_at
+        """,
+        [
+            (
+                dados["chave_nfe"], dados["cnpj"], dados["valor_nota"], dados["data_emissao"],
+                json.dumps(dados["parcelas"]), taxa_ia, taxa_cliente, agora, agora
+            )
+            for dados, taxa_ia, taxa_cliente in cotacoes
+        ]
+    )
+    conn.commit()
+
+
+def registrar_nota(conn, dados, taxa_ia, taxa_cliente=None):
+    """
+    Grava (ou atualiza) a nota no registro junto com a última cotação.
+    """
+    registrar_notas(conn, [(dados, taxa_ia, taxa_cliente)])
@@ -0,0 +1,175 @@
+import cProfile
+import functools
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# Modo de perfilamento sob demanda: o admin arma, o próximo rerun de cliente (ou de
+# um fragmento de nota) é medido (cProfile + tracemalloc) e o resultado entra num
+# histórico limitado. Com um alvo (usuário ou rótulo), só um rerun daquele usuário ou
+# daquela página é capturado.
+# O estado fica no módulo, que o Streamlit não reexecuta, e vale para todas as sessões;
+# por isso o pico do tracemalloc inclui alocações de outras sessões feitas no meio.
+MAX_PERFIS = 20
+MAX_FUNCOES = 40
+
+perfis = deque(maxlen=MAX_PERFIS)
+
+_lock = threading.Lock()
+_armado = False
+_alvo = None
+_thread_perfilada = None
+_secoes = []
+_pilha = []
+
+
+def armar(alvo=None):
+    """
+    Arma a captura. Com `alvo`, só vale um rerun cujo rótulo ou usuário seja igual a ele.
+    """
+    global _armado, _alvo
+    with _lock:
+        _armado = True
+        _alvo = alvo or None
+
+
+def desarmar():
+    global _armado, _alvo
+    with _lock:
+        _armado = False
+        _alvo = None
+
+
+def esta_armado():
+    return _armado
+
+
+def alvo():
+    return _alvo
+
+
+def _ativo():
+    return _thread_perfilada == threading.get_ident()
+
+
+@contextmanager
+def perfilar_rerun(rotulo, usuario=None):
+    """
+    Perfila o trecho do rerun se o modo estiver armado (e o alvo, se houver, for este
+    rótulo ou este usuário); caso contrário não faz nada.
+    Só um rerun é capturado por vez e o modo se desarma ao começar a captura.
+    """
+    global _armado, _alvo, _thread_perfilada, _secoes
+    with _lock:
+        capturar = _armado and _thread_perfilada is None and _alvo in (None, rotulo, usuario)
+        if capturar:
+            _armado = False
+            _alvo = None
+            _thread_perfilada = threading.get_ident()
+            _secoes = []
+    if not capturar:
+        yield
+        return
+
+    iniciou_tracemalloc = not tracemalloc.is_tracing()
+    if iniciou_tracemalloc:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    perfil = cProfile.Profile()
+    inicio = time.perf_counter()
+    perfil.enable()
+    try:
+        yield
+    finally:
+        perfil.disable()
+        duracao = time.perf_counter() - inicio
+        pico = tracemalloc.get_traced_memory()[1]
+        if iniciou_tracemalloc:
+            tracemalloc.stop()
+        perfis.appendleft({
+            "quando": datetime.now(),
+            "rotulo": rotulo,
+            "usuario": usuario,
+            "duracao": duracao,
+            "pico_memoria": max([pico] + [s["pico_memoria"] for s in _secoes]),
+            "secoes": list(_secoes),
+            "funcoes": _resumir_funcoes(perfil),
+        })
+        with _lock:
+            _thread_perfilada = None
+
+
+@contextmanager
+def secao(nome):
+    """
+    Mede tempo e pico de memória de um trecho, apenas dentro de um rerun perfilado.
+    """
+    if not _ativo():
+        yield
+        return
+
+    # tracemalloc só guarda um pico global: o pico do trecho pai é salvo antes de zerar
+    if _pilha:
+        _pilha[-1][1] = max(_pilha[-1][1], tracemalloc.get_traced_memory()[1])
+    tracemalloc.reset_peak()
+    _pilha.append([time.perf_counter(), 0])
+    try:
+        yield
+    finally:
+        inicio, pico_filhos = _pilha.pop()
+        pico = max(pico_filhos, tracemalloc.get_traced_memory()[1])
+        if _pilha:
+            _pilha[-1][1] = max(_pilha[-1][1], pico)
+        tracemalloc.reset_peak()
+        _secoes.append({
+            "secao": nome,
+            "tempo": time.perf_counter() - inicio,
+            "pico_memoria": pico,
+        })
+
+
+def medir(nome):
+    """
+    Decorador equivalente a `secao` para funções inteiras.
+    """
+    def decorador(func):
+        @functools.wraps(func)
+        def envoltorio(*args, **kwargs):
+            with secao(nome):
+                return func(*args, **kwargs)
+        return envoltorio
+    return decorador
+
+
+def perfilar(rotulo, usuario=None):
+    """
+    Decorador equivalente a `perfilar_rerun`, para funções que rodam sozinhas
+    (fragmentos reexecutados sem o restante do script). `usuario` pode ser uma
+    função, chamada a cada execução.
+    """
+    def decorador(func):
+        @functools.wraps(func)
+        def envoltorio(*args, **kwargs):
+            with perfilar_rerun(rotulo, usuario() if callable(usuario) else usuario):
+                return func(*args, **kwargs)
+        return envoltorio
+    return decorador
+
+
+def _resumir_funcoes(perfil):
+    estatisticas = pstats.Stats(perfil).stats
+    linhas = [
+        {
+            "funcao": f"{funcao} ({arquivo}:{linha})",
+            "chamadas": chamadas,
+            "tempo_proprio": tempo_proprio,
+            "tempo_cumulativo": tempo_cumulativo,
+        }
+        for (arquivo, linha, funcao), (_, chamadas, tempo_proprio, tempo_cumulativo, _) in estatisticas.items()
+    ]
+    linhas.sort(key=lambda l: l["tempo_cumulativo"], reverse=True)
+    return linhas[:MAX_FUNCOES]
@@ -0,0 +1,417 @@
+"""
+Serviço HTTP local de cotação para parceiros.
+
+Recebe o XML da NF-e (ou os campos já extraídos) mais os dados de crédito e devolve
+a mesma cotação da aba de cotação. Pedidos simultâneos são agrupados em micro-lotes:
+o risco é calculado de uma vez para o lote inteiro e as notas são gravadas no
+registro numa única transação, numa thread própria: a gravação não segura a cotação
+dos demais pedidos.
+
+Uso:
+    python servico_cotacao.py --porta 8502
+
+Rotas:
+    POST /cotacao          um pedido (JSON ou XML puro) ou uma lista JSON de pedidos
+    GET  /notas/<chave>    nota já registrada, pela chave de acesso
+    GET  /estatisticas     latência, profundidade da fila e tamanho médio dos lotes
+
+Só notas vindas de um XML são gravadas no registro; pedidos com os campos já
+extraídos são cotados, mas não gravados.
+"""
+import argparse
+import json
+import math
+import queue
+import sqlite3
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from cotacao import buscar_nota, calcular_risco_lote, criar_registro_notas, extrair_dados_nfe, registrar_notas
+
+DATA_PATH = "clientes.db"
+
+# Mesmos valores iniciais dos campos de crédito da aba de cotação
+CREDITO_PADRAO = {"score": 750, "idade_empresa": 5, "protestos": False, "faturamento": 0.0}
+
+# Respostas aceitas em "protestos", como na aba de cotação ("Não"/"Sim")
+PROTESTOS = {"sim": True, "não": False, "nao": False, "true": True, "false": False, "1": True, "0": False}
+
+# Janela (s) usada para a vazão em /estatisticas
+JANELA_VAZAO = 60
+
+# Maior corpo aceito em POST /cotacao (bytes)
+MAX_CORPO = 10 * 1024 * 1024
+
+
+class PoolConexoes:
+    """
+    Conjunto fixo de conexões SQLite reaproveitadas entre as threads do serviço.
+    """
+
+    def __init__(self, caminho, tamanho=4):
+        self._livres = queue.Queue()
+        for _ in range(tamanho):
+            conn = sqlite3.connect(caminho, check_same_thread=False, timeout=10)
+            # WAL deixa as leituras seguirem enquanto o lote grava
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._livres.put(conn)
+
+    @contextmanager
+    def conexao(self):
+        conn = self._livres.get()
+        try:
+            yield conn
+        finally:
+            self._livres.put(conn)
+
+
+class LoteadorCotacoes:
+    """
+    Junta pedidos que chegam juntos em lotes de até `max_lote`, esperando no máximo
+    `janela` segundos após o primeiro, e cota cada lote de uma só vez. Pedidos que não
+    vão para o registro são respondidos logo após a cotação; os de XML, depois que a
+    thread de gravação grava a nota.
+    """
+
+    def __init__(self, pool, max_lote=512, janela=0.002):
+        self.pool = pool
+        self.max_lote = max_lote
+        self.janela = janela
+        self.fila = queue.Queue()
+        self.gravacoes = queue.Queue()
+        self.latencias = deque(maxlen=10_000)
+        self.total_cotacoes = 0
+        self.total_lotes = 0
+        self.lotes_recentes = deque()  # (instante, tamanho) dos lotes da última janela
+        self.inicio = time.monotonic()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._processar, name="loteador-cotacoes", daemon=True).start()
+        threading.Thread(target=self._gravar, name="gravador-notas", daemon=True).start()
+
+    def enviar(self, pedido):
+        futuro = Future()
+        self.fila.put((pedido, futuro, time.perf_counter()))
+        return futuro
+
+    def _coletar_lote(self):
+        lote = [self.fila.get()]
+        limite = time.monotonic() + self.janela
+        while len(lote) < self.max_lote:
+            restante = limite - time.monotonic()
+            try:
+                lote.append(self.fila.get(timeout=restante) if restante > 0 else self.fila.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _processar(self):
+        while True:
+            lote = self._coletar_lote()
+            try:
+                resultados = self._cotar_lote([pedido for pedido, _, _ in lote])
+            except Exception as e:
+                resultados = [e] * len(lote)
+
+            prontos, a_gravar = [], []
+            for item, resultado in zip(lote, resultados):
+                # Notas de XML só são respondidas depois de gravadas no registro
+                if item[0]["registrar"] and not isinstance(resultado, Exception):
+                    a_gravar.append((item, resultado))
+                else:
+                    prontos.append((item, resultado))
+            self._resolver(prontos)
+            if a_gravar:
+                self.gravacoes.put(a_gravar)
+
+            instante = time.monotonic()
+            with self._lock:
+                self.total_cotacoes += len(lote)
+                self.total_lotes += 1
+                self.lotes_recentes.append((instante, len(lote)))
+                while self.lotes_recentes[0][0] < instante - JANELA_VAZAO:
+                    self.lotes_recentes.popleft()
+
+    def _resolver(self, itens):
+        # Cada pedido recebe o próprio resultado ou o próprio erro
+        agora = time.perf_counter()
+        for (_, futuro, _), resultado in itens:
+            if isinstance(resultado, Exception):
+                futuro.set_exception(resultado)
+            else:
+                futuro.set_result(resultado)
+        with self._lock:
+            self.latencias.extend(agora - chegada for (_, _, chegada), _ in itens)
+
+    def _gravar(self):
+        while True:
+            # Junta numa transação só tudo o que se acumulou enquanto a anterior gravava
+            itens = self.gravacoes.get()
+            while True:
+                try:
+                    itens.extend(self.gravacoes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                erros = self._registrar(itens)
+            except Exception as e:
+                erros = dict.fromkeys(range(len(itens)), e)
+            self._resolver([(item, erros.get(i, resultado)) for i, (item, resultado) in enumerate(itens)])
+
+    def _cotar_lote(self, pedidos):
+        valores = np.fromiter((p["dados"]["valor_nota"] for p in pedidos), dtype=np.float64, count=len(pedidos))
+        risco_total, taxa_ia = calcular_risco_lote(
+            [p["score"] for p in pedidos],
+            [p["idade_empresa"] for p in pedidos],
+            [p["protestos"] for p in pedidos],
+            [p["faturamento"] for p in pedidos],
+        )
+        valor_receber = np.round(valores * (1 - taxa_ia / 100), 2)
+
+        return [
+            {
+                "chave_nfe": p["dados"]["chave_nfe"],
+                "cnpj": p["dados"]["cnpj"],
+                "valor_nota": p["dados"]["valor_nota"],
+                "data_emissao": p["dados"]["data_emissao"],
+                "risco_total": float(risco),
+                "taxa_ia": float(taxa),
+                "valor_receber": float(receber),
+            }
+            for p, risco, taxa, receber in zip(pedidos, risco_total, taxa_ia, valor_receber)
+        ]
+
+    def _registrar(self, itens):
+        """
+        Grava no registro as notas cotadas, numa transação só. Se ela falhar, grava
+        uma a uma para que o erro volte apenas ao pedido culpado.
+        Retorna {índice do item: exceção}.
+        """
+        cotacoes = [(pedido["dados"], resultado["taxa_ia"], None) for (pedido, _, _), resultado in itens]
+        erros = {}
+        with self.pool.conexao() as conn:
+            try:
+                registrar_notas(conn, cotacoes)
+            except sqlite3.Error:
+                conn.rollback()
+                for i, cotacao in enumerate(cotacoes):
+                    try:
+                        registrar_notas(conn, [cotacao])
+                    except sqlite3.Error as e:
+                        conn.rollback()
+                        erros[i] = e
+        return erros
+
+    def estatisticas(self):
+        with self._lock:
+            latencias = np.array(self.latencias)
+            total_cotacoes, total_lotes = self.total_cotacoes, self.total_lotes
+            agora = time.monotonic()
+            recentes = sum(tamanho for instante, tamanho in self.lotes_recentes if instante >= agora - JANELA_VAZAO)
+        janela = min(JANELA_VAZAO, agora - self.inicio)
+        percentis = (
+            dict(zip(("p50", "p95", "p99"), np.round(np.percentile(latencias, [50, 95, 99]) * 1000, 3).tolist()))
+            if latencias.size else {}
+        )
+        return {
+            "cotacoes": total_cotacoes,
+            "lotes": total_lotes,
+            "media_por_lote": round(total_cotacoes / total_lotes, 2) if total_lotes else 0,
+            "fila": self.fila.qsize(),
+            "fila_gravacao": self.gravacoes.qsize(),
+            "latencia_ms": percentis,
+            # Vazão do último minuto (ou desde a partida, se o serviço for mais novo)
+            "cotacoes_por_segundo": round(recentes / janela, 2) if janela > 0 else 0,
+        }
+
+
+def _numero(pedido, campo, padrao=None, minimo=None, maximo=None):
+    valor = pedido.get(campo, padrao)
+    if isinstance(valor, bool) or valor is None:
+        raise ValueError(f"'{campo}' deve ser numérico.")
+    valor = float(valor)
+    if not math.isfinite(valor):
+        raise ValueError(f"'{campo}' deve ser um número finito.")
+    # Mesmos limites dos campos da aba de cotação
+    if (minimo is not None and valor < minimo) or (maximo is not None and valor > maximo):
+        raise ValueError(f"'{campo}' fora do intervalo aceito.")
+    return valor
+
+
+def _protestos(pedido):
+    valor = pedido.get("protestos", CREDITO_PADRAO["protestos"])
+    if isinstance(valor, bool):
+        return valor
+    if isinstance(valor, (int, float)) and valor in (0, 1):
+        return bool(valor)
+    if isinstance(valor, str) and valor.strip().lower() in PROTESTOS:
+        return PROTESTOS[valor.strip().lower()]
+    raise ValueError("'protestos' deve ser verdadeiro/falso, 0/1 ou 'sim'/'não'.")
+
+
+def _texto_opcional(pedido, campo):
+    valor = pedido.get(campo)
+    if valor is not None and not isinstance(valor, str):
+        raise ValueError(f"'{campo}' deve ser texto.")
+    return valor
+
+
+def interpretar_pedido(pedido):
+    """
+    Monta o pedido de cotação a partir do XML da NF-e ou dos campos já extraídos.
+    Levanta ValueError se o pedido estiver incompleto ou com campos de tipo errado.
+    """
+    if not isinstance(pedido, dict):
+        raise ValueError("Cada pedido deve ser um objeto JSON.")
+
+    if pedido.get("xml"):
+        dados = extrair_dados_nfe(ET.fromstring(pedido["xml"]))
+        registrar = bool(dados["chave_nfe"])
+    elif "valor_nota" in pedido:
+        parcelas = pedido.get("parcelas", [])
+        if not (isinstance(parcelas, list) and all(isinstance(p, dict) for p in parcelas)):
+            raise ValueError("'parcelas' deve ser uma lista de objetos.")
+        chave = str(pedido.get("chave_nfe") or "")
+        dados = {
+            "chave_nfe": chave if len(chave) == 44 and chave.isdigit() else None,
+            "valor_nota": _numero(pedido, "valor_nota"),
+            "cnpj": _texto_opcional(pedido, "cnpj"),
+            "data_emissao": _texto_opcional(pedido, "data_emissao"),
+            "parcelas": parcelas,
+        }
+        # Campos enviados pelo parceiro não são verificados: cota, mas não grava no registro
+        registrar = False
+    else:
+        raise ValueError("Informe 'xml' ou 'valor_nota'.")
+
+    if not math.isfinite(dados["valor_nota"]):
+        raise ValueError("'valor_nota' deve ser um número finito.")
+
+    return {
+        "dados": dados,
+        "registrar": registrar,
+        "score": _numero(pedido, "score", CREDITO_PADRAO["score"], 0, 1000),
+        "idade_empresa": _numero(pedido, "idade_empresa", CREDITO_PADRAO["idade_empresa"], 0, 100),
+        "protestos": _protestos(pedido),
+        "faturamento": _numero(pedido, "faturamento", CREDITO_PADRAO["faturamento"], 0),
+    }
+
+
+class ServidorCotacao(ThreadingHTTPServer):
+    daemon_threads = True
+    # A fila padrão de conexões (5) derruba clientes em rajadas de pedidos simultâneos
+    request_queue_size = 1024
+
+
+class ManipuladorCotacao(BaseHTTPRequestHandler):
+    loteador = None
+    protocol_version = "HTTP/1.1"
+    # Cabeçalho e corpo saem em duas escritas; com Nagle ligado, a segunda espera o ACK
+    # atrasado do cliente (~40 ms) a cada resposta numa conexão mantida
+    disable_nagle_algorithm = True
+
+    def _responder(self, status, corpo):
+        conteudo = json.dumps(corpo, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(conteudo)))
+        self.end_headers()
+        self.wfile.write(conteudo)
+
+    def do_POST(self):
+        # O corpo é lido antes de qualquer resposta: com conexão mantida (HTTP/1.1),
+        # bytes deixados no socket seriam lidos como o próximo pedido
+        try:
+            tamanho = int(self.headers.get("Content-Length", 0))
+            if tamanho < 0:
+                raise ValueError
+        except ValueError:
+            self.close_connection = True
+            return self._responder(400, {"erro": "Content-Length inválido."})
+        if tamanho > MAX_CORPO:
+            # O corpo não é lido: a conexão é fechada em vez de drenada
+            self.close_connection = True
+            return self._responder(413, {"erro": f"Corpo acima do limite de {MAX_CORPO} bytes."})
+        corpo = self.rfile.read(tamanho)
+
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/cotacao":
+            return self._responder(404, {"erro": "Rota não encontrada."})
+
+        try:
+            if "xml" in self.headers.get("Content-Type", "") or corpo.lstrip().startswith(b"<"):
+                # XML puro no corpo; dados de crédito na query string (que não substitui o XML)
+                pedidos = [{**{k: v[0] for k, v in parse_qs(url.query).items()}, "xml": corpo}]
+                lote = False
+            else:
+                recebido = json.loads(corpo)
+                lote = isinstance(recebido, list)
+                pedidos = recebido if lote else [recebido]
+            pedidos = [interpretar_pedido(p) for p in pedidos]
+        except (ValueError, TypeError, AttributeError, ET.ParseError) as e:
+            return self._responder(400, {"erro": f"Pedido inválido: {e}"})
+
+        futuros = [self.loteador.enviar(p) for p in pedidos]
+        resultados = []
+        for futuro in futuros:
+            try:
+                resultados.append(futuro.result(timeout=10))
+            except Exception as e:
+                resultados.append({"erro": f"Erro ao cotar: {e}"})
+        if lote:
+            # Em lotes, um item com erro não derruba os demais
+            return self._responder(200, resultados)
+        self._responder(500 if "erro" in resultados[0] else 200, resultados[0])
+
+    def do_GET(self):
+        caminho = urlparse(self.path).path.rstrip("/")
+        if caminho == "/estatisticas":
+            return self._responder(200, self.loteador.estatisticas())
+        if caminho.startswith("/notas/"):
+            with self.loteador.pool.conexao() as conn:
+                nota = buscar_nota(conn, caminho.rsplit("/", 1)[1])
+            if nota is None:
+                return self._responder(404, {"erro": "Nota não registrada."})
+            return self._responder(200, nota)
+        self._responder(404, {"erro": "Rota não encontrada."})
+
+    def log_message(self, formato, *args):
+        # Sem log por requisição: com milhares de cotações por segundo ele vira o gargalo
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serviço HTTP local de cotação de antecipação.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8502)
+    parser.add_argument("--banco", default=DATA_PATH)
+    parser.add_argument("--conexoes", type=int, default=4)
+    parser.add_argument("--max-lote", type=int, default=512)
+    parser.add_argument("--janela-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    pool = PoolConexoes(args.banco, args.conexoes)
+    with pool.conexao() as conn:
+        criar_registro_notas(conn.cursor())
+        conn.commit()
+
+    ManipuladorCotacao.loteador = LoteadorCotacoes(pool, args.max_lote, args.janela_ms / 1000)
+    servidor = ServidorCotacao((args.host, args.porta), ManipuladorCotacao)
+    print(f"Serviço de cotação em http://{args.host}:{args.porta}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()